@@ -1,16 +1,35 @@
+import os
+
 import redis
-from flask import Flask
+from flask import Flask, request
+
+from counter import HitCounter
+
+# Connessione al servizio chiamato "redis", tramite un pool di connessioni condiviso
+pool = redis.ConnectionPool(
+    host=os.environ.get('REDIS_HOST', 'redis'),
+    port=int(os.environ.get('REDIS_PORT', '6379')),
+    max_connections=int(os.environ.get('REDIS_MAX_CONNECTIONS', '10')),
+    socket_timeout=float(os.environ.get('REDIS_TIMEOUT', '0.5')),
+    socket_connect_timeout=float(os.environ.get('REDIS_TIMEOUT', '0.5')),
+)
+cache = redis.Redis(connection_pool=pool)
 
-# Connessione al servizio chiamato "redis"
-cache = redis.Redis(host='redis', port=6379)
+# Le visite vengono sommate in memoria e inviate a Redis ogni HITS_FLUSH_INTERVAL secondi
+hits = HitCounter(
+    cache,
+    flush_interval=float(os.environ.get('HITS_FLUSH_INTERVAL', '1.0')),
+    shards=int(os.environ.get('HITS_SHARDS', '1')),
+    per_path=os.environ.get('HITS_PER_PATH', 'false').lower() in ('1', 'true', 'yes'),
+).start()
 
 app = Flask(__name__)
 
 
 @app.route('/')
 def home():
-    # Incrementa il contatore nel DB
-    count = cache.incr('hits')
+    # Incrementa il contatore (anche se Redis è lento o non disponibile)
+    count = hits.incr(request.path)
     return f"<h1>Questa pagina è stata vista {count} volte.</h1>"
 
 
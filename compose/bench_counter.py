@@ -0,0 +1,121 @@
+"""Benchmark del contatore di visite contro un finto Redis locale.
+
+Confronta un INCR sincrono per visita con HitCounter (aggregazione locale + pipeline),
+anche con Redis spento. Il finto Redis parla il protocollo RESP e implementa solo i
+comandi usati dal contatore; LATENCY simula il tempo di rete di ogni comando.
+
+Uso: python bench_counter.py [visite per thread]
+"""
+import socketserver
+import sys
+import threading
+import time
+
+import redis
+
+from counter import HitCounter
+
+VISITS_PER_THREAD = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+THREADS = 8
+LATENCY = 0.0005  # secondi per comando
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Un finto server Redis: INCR, INCRBY, GET, MGET; OK per tutto il resto."""
+
+    data = {}
+    lock = threading.Lock()
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def reply(self, value):
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(self.reply(v) for v in value)
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def handle(self):
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            time.sleep(LATENCY)
+            command = args[0].upper()
+            with self.lock:
+                if command in (b"INCR", b"INCRBY"):
+                    amount = int(args[2]) if command == b"INCRBY" else 1
+                    self.data[args[1]] = self.data.get(args[1], 0) + amount
+                    response = self.reply(self.data[args[1]])
+                elif command == b"GET":
+                    response = self.reply(self.get(args[1]))
+                elif command == b"MGET":
+                    response = self.reply([self.get(key) for key in args[1:]])
+                else:
+                    response = b"+OK\r\n"
+            self.wfile.write(response)
+
+    def get(self, key):
+        return str(self.data[key]).encode() if key in self.data else None
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def run(name, visit):
+    def worker():
+        for _ in range(VISITS_PER_THREAD):
+            visit()
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    visits = THREADS * VISITS_PER_THREAD
+    print(f"{name:<36} {elapsed:7.3f}s {visits / elapsed:10.0f} visite/s")
+
+
+if __name__ == '__main__':
+    server = FakeRedisServer(('127.0.0.1', 0), FakeRedisHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    # Il finto Redis parla solo RESP2
+    pool = redis.ConnectionPool(host='127.0.0.1', port=port, max_connections=THREADS, protocol=2)
+    cache = redis.Redis(connection_pool=pool)
+    visits = THREADS * VISITS_PER_THREAD
+
+    run('INCR sincrono per visita', lambda: cache.incr('hits'))
+    print(f"  valore in Redis: {int(cache.get('hits'))} (attese {visits})")
+
+    for shards in (1, 4):
+        counter = HitCounter(cache, key=f'buffered{shards}', flush_interval=0.1, shards=shards, per_path=True)
+        counter.start()
+        run(f'HitCounter, {shards} shard', lambda: counter.incr('/'))
+        counter.stop()
+        print(f"  valore in Redis: {counter.count()} (attese {visits})")
+
+    # Redis spento: le visite vengono contate comunque e restano in memoria
+    down = redis.Redis(host='127.0.0.1', port=1, socket_connect_timeout=0.1, protocol=2)
+    counter = HitCounter(down, key='down', flush_interval=0.1)
+    counter.start()
+    run('HitCounter, Redis non disponibile', counter.incr)
+    counter.stop()
+    print(f"  visite in memoria: {counter.count()} (attese {visits})")
+
+    server.shutdown()
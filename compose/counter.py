@@ -0,0 +1,146 @@
+import atexit
+import logging
+import random
+import threading
+from collections import Counter
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class HitCounter:
+    """Contatore di visite aggregato in locale e inviato a Redis a intervalli.
+
+    Ogni incremento resta in memoria; un thread in background lo invia a Redis con
+    una sola pipeline ogni flush_interval secondi. Con shards > 1 ogni contatore è
+    diviso su più chiavi (nome:0 ... nome:N-1) per evitare una singola chiave "calda";
+    la vecchia chiave non divisa (nome) viene comunque sommata al totale.
+    Se Redis non è raggiungibile gli incrementi restano in memoria e si riprova al flush
+    successivo; se l'errore arriva dopo l'invio non si riprova, per non contare due volte.
+    """
+
+    def __init__(self, client, key='hits', flush_interval=1.0, shards=1, per_path=False):
+        self.client = client
+        self.key = key
+        self.flush_interval = flush_interval
+        self.shards = shards
+        self.per_path = per_path
+
+        self._pending = Counter()      # chiave Redis -> incrementi non ancora inviati
+        self._inflight = Counter()     # incrementi del flush in corso (ancora contati nella stima)
+        self._totals = {}              # contatore -> ultimo valore letto da Redis
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def counter_name(self, path=None):
+        """Nome del contatore: quello globale o quello della pagina."""
+        return f"{self.key}:path:{path}" if path is not None else self.key
+
+    def shard_keys(self, name):
+        if self.shards == 1:
+            return [name]
+        return [f"{name}:{n}" for n in range(self.shards)]
+
+    def read_keys(self, name):
+        """Chiavi da sommare per il totale: gli shard più la chiave non divisa usata prima degli shard."""
+        if self.shards == 1:
+            return [name]
+        return [name] + self.shard_keys(name)
+
+    def incr(self, path=None):
+        """Conta una visita (e una per la pagina, se per_path) e restituisce il totale stimato."""
+        names = [self.counter_name()]
+        if self.per_path and path is not None:
+            names.append(self.counter_name(path))
+
+        with self._lock:
+            for name in names:
+                self._pending[random.choice(self.shard_keys(name))] += 1
+            return self._estimate(names[0])
+
+    def count(self, path=None):
+        """Totale stimato: ultimo valore letto da Redis più gli incrementi locali."""
+        with self._lock:
+            return self._estimate(self.counter_name(path))
+
+    def _estimate(self, name):
+        keys = self.shard_keys(name)
+        pending = sum(self._pending[k] + self._inflight[k] for k in keys)
+        return self._totals.get(name, 0) + pending
+
+    def flush(self):
+        """Invia a Redis gli incrementi in sospeso con una sola pipeline e aggiorna i totali."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, Counter()
+                self._inflight = pending
+
+            # Contatori di cui rileggere il totale (sommando tutte le loro chiavi)
+            names = {self.counter_name()}
+            names.update(key.rsplit(':', 1)[0] if self.shards > 1 else key for key in pending)
+            names = sorted(names)
+
+            try:
+                # La connessione viene aperta prima di inviare qualsiasi comando
+                pool = self.client.connection_pool
+                pool.release(pool.get_connection())
+            except redis.ConnectionError as e:
+                # Redis non raggiungibile, niente è stato inviato: gli incrementi tornano in coda
+                logger.warning(f"Redis non disponibile, {sum(pending.values())} visite in attesa: {e}")
+                with self._lock:
+                    self._pending.update(pending)
+                    self._inflight = Counter()
+                return False
+
+            try:
+                pipe = self.client.pipeline(transaction=False)
+                for key, amount in pending.items():
+                    pipe.incrby(key, amount)
+                for name in names:
+                    pipe.mget(self.read_keys(name))
+                results = pipe.execute(raise_on_error=False)
+            except redis.RedisError as e:
+                # I comandi potrebbero essere già stati applicati: rinviarli conterebbe due volte
+                logger.error(f"Flush interrotto, {sum(pending.values())} visite potrebbero non essere contate: {e}")
+                with self._lock:
+                    self._inflight = Counter()
+                return False
+
+            # Con raise_on_error=False gli errori dei singoli comandi sono nei risultati
+            failed = {key: result for key, result in zip(pending, results) if isinstance(result, Exception)}
+            if failed:
+                logger.error(f"INCRBY fallito per {', '.join(failed)}: {next(iter(failed.values()))}")
+
+            totals = results[len(pending):]
+            with self._lock:
+                for name, values in zip(names, totals):
+                    try:
+                        self._totals[name] = sum(int(v) for v in values if v is not None)
+                    except (TypeError, ValueError):
+                        # Risposta di errore o chiave non numerica: resta l'ultimo totale valido
+                        logger.error(f"Totale non leggibile per {name}: {values}")
+                # I totali appena letti comprendono già questo flush
+                self._inflight = Counter()
+            return not failed
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def start(self):
+        """Avvia il thread di flush periodico (e un ultimo flush all'uscita)."""
+        if self._thread is None:
+            self.flush()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
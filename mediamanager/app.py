@@ -1,13 +1,25 @@
 import os
 import json
 import time
+import uuid
 import shutil
+import errno
+import hashlib
+import sqlite3
+import fnmatch
 import logging
-from threading import Thread, Lock
-
-from flask import Flask, jsonify, request, send_from_directory
+import unicodedata
+from queue import Queue, Empty
+from threading import Thread, Lock, Condition, Event
+from itertools import islice
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import Flask, Response, jsonify, request, send_from_directory
 from flask_cors import CORS
-from mutagen.id3 import ID3NoHeaderError
+from mutagen.id3 import ID3, ID3NoHeaderError
+from mutagen.ogg import OggPage
 
 from mutagen.mp3 import MP3
 from mutagen.flac import FLAC
@@ -25,15 +37,59 @@ import musicbrainzngs
 INPUT_DIR = os.environ.get('INPUT_DIR', '/app/input')
 OUTPUT_DIR = os.environ.get('OUTPUT_DIR', '/app/output')
 MUSICBRAINZ_USER_AGENT = os.environ.get('MUSICBRAINZ_USER_AGENT', 'MediaManagerApp/1.0 (studente.example@email.com)')
+# Persistent cache of MusicBrainz searches (TTL in seconds; "no result" entries expire sooner)
+MUSICBRAINZ_CACHE_PATH = os.environ.get('MUSICBRAINZ_CACHE_PATH', '/app/cache/musicbrainz.db')
+MUSICBRAINZ_CACHE_TTL = int(os.environ.get('MUSICBRAINZ_CACHE_TTL', str(30 * 24 * 3600)))
+MUSICBRAINZ_CACHE_NEGATIVE_TTL = int(os.environ.get('MUSICBRAINZ_CACHE_NEGATIVE_TTL', str(24 * 3600)))
+# Duplicate detection: hash of the audio payload (tags excluded) of every file in OUTPUT_DIR
+DUPLICATE_DETECTION = os.environ.get('DUPLICATE_DETECTION', 'false').lower() in ('1', 'true', 'yes')
+LIBRARY_INDEX_PATH = os.environ.get('LIBRARY_INDEX_PATH', '/app/cache/library.db')
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# Tag extraction: 'lean' reads only the tag blocks, 'full' opens the complete Mutagen objects
+TAG_EXTRACTION_MODE = os.environ.get('TAG_EXTRACTION_MODE', 'lean')
+EXTRACT_WORKERS = int(os.environ.get('EXTRACT_WORKERS', str(os.cpu_count() or 1)))
+# Batches smaller than this are extracted in-thread: the process pool is not worth it
+EXTRACT_POOL_MIN_BATCH = 16
+# A new file is extracted once it has had no events for this many seconds and its size/mtime stopped changing
+FILE_SETTLE_TIME = 1.0
 
 MUSIC_EXTENSIONS = ('.mp3', '.flac', '.ogg')
 DEFAULT_NAMING_PATTERN = "{artist}/{album}/{track:02d} - {title}.{ext}"
+# Batch jobs run in two stages: MusicBrainz lookups (throttled to ~1 request/sec by the
+# process-wide, thread-safe musicbrainzngs limiter) and moves, so a long copy never leaves
+# the lookup rate unused
+JOB_LOOKUP_WORKERS = int(os.environ.get('JOB_LOOKUP_WORKERS', '2'))
+JOB_MOVE_WORKERS = int(os.environ.get('JOB_MOVE_WORKERS', '2'))
+# Completed jobs kept for polling (the oldest ones are dropped beyond this number)
+MAX_FINISHED_JOBS = int(os.environ.get('MAX_FINISHED_JOBS', '50'))
+# Removed files remembered for delta clients; older clients get a full resync
+MAX_STATUS_TOMBSTONES = int(os.environ.get('MAX_STATUS_TOMBSTONES', '10000'))
+STATUS_PAGE_SIZE = 500
 
 # Global application state
 user_files = {}
 file_lock = Lock()
 current_naming_pattern = DEFAULT_NAMING_PATTERN
 
+# Versioned change log of user_files, used for delta status and the event stream.
+# Every change bumps status_version; file_changes maps filename -> version of its last
+# change (oldest first), removed files stay in it as tombstones (also kept in removed_files).
+status_version = 0
+file_changes = OrderedDict()
+removed_files = OrderedDict()
+tombstone_floor = 0  # versions <= floor may have lost their tombstones
+file_changed = Condition(file_lock)
+
+# Batch rename jobs (job id -> job state)
+jobs = {}
+jobs_lock = Lock()
+lookup_executor = ThreadPoolExecutor(max_workers=JOB_LOOKUP_WORKERS, thread_name_prefix='job-lookup')
+move_executor = ThreadPoolExecutor(max_workers=JOB_MOVE_WORKERS, thread_name_prefix='job-move')
+
+# Watchdog events (path, time) of new files, extracted in batches; the process pool is created on first use
+ingest_queue = Queue()
+extract_pool = None
+
 # Logger configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -52,9 +108,88 @@ os.makedirs(INPUT_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 logger.info(f"Input Directory: {INPUT_DIR}, Output Directory: {OUTPUT_DIR}")
 
+# MusicBrainz cache database (shared by all threads, serialized by its own lock)
+os.makedirs(os.path.dirname(MUSICBRAINZ_CACHE_PATH) or '.', exist_ok=True)
+mb_cache = sqlite3.connect(MUSICBRAINZ_CACHE_PATH, check_same_thread=False)
+mb_cache.execute(
+    "CREATE TABLE IF NOT EXISTS recordings (key TEXT PRIMARY KEY, recording TEXT, expires_at REAL NOT NULL)")
+mb_cache.execute("CREATE INDEX IF NOT EXISTS recordings_expires_at ON recordings (expires_at)")
+# Expired entries are purged at startup and on every write, so the database does not grow forever
+mb_cache.execute("DELETE FROM recordings WHERE expires_at <= ?", (time.time(),))
+mb_cache.commit()
+mb_cache_lock = Lock()
+
+# Audio hash index of the output library (only when DUPLICATE_DETECTION is enabled).
+# Moves wait for library_index_ready: before that, duplicates already in the library would be missed
+library_db = None
+library_db_lock = Lock()
+library_index_ready = Event()
+library_index_lock = Lock()
+library_index_thread = None
+if DUPLICATE_DETECTION:
+    os.makedirs(os.path.dirname(LIBRARY_INDEX_PATH) or '.', exist_ok=True)
+    library_db = sqlite3.connect(LIBRARY_INDEX_PATH, check_same_thread=False)
+    library_db.execute(
+        "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, audio_hash TEXT NOT NULL)")
+    library_db.execute("CREATE INDEX IF NOT EXISTS files_audio_hash ON files (audio_hash)")
+    library_db.commit()
+
+# Serializes the fallback moves on filesystems without hard links (check + replace is not atomic)
+move_fallback_lock = Lock()
+
 
 # --- UTILITY FUNCTIONS ---
 
+def record_file_change(filename):
+    """Bumps the status version for filename. Must be called with file_lock held."""
+    global status_version, tombstone_floor
+    status_version += 1
+    file_changes[filename] = status_version
+    file_changes.move_to_end(filename)
+
+    removed_files.pop(filename, None)
+    if filename not in user_files:
+        removed_files[filename] = status_version
+        # Forget the oldest tombstones beyond the limit
+        while len(removed_files) > MAX_STATUS_TOMBSTONES:
+            old_name, old_version = removed_files.popitem(last=False)
+            del file_changes[old_name]
+            tombstone_floor = old_version
+
+    file_changed.notify_all()
+    return status_version
+
+
+def set_file(filename, metadata):
+    """Adds or replaces a file entry, stamping it with a new version. Must be called with file_lock held."""
+    user_files[filename] = metadata
+    metadata['version'] = record_file_change(filename)
+
+
+def remove_file(filename):
+    """Removes a file entry, leaving a tombstone for delta clients. Must be called with file_lock held."""
+    if user_files.pop(filename, None) is not None:
+        record_file_change(filename)
+
+
+def get_status_delta(since):
+    """Returns the files changed and removed after version since. Must be called with file_lock held.
+
+    The change log is walked from the newest end, so the cost is proportional to the changes.
+    """
+    changed, removed = [], []
+    for filename, version in reversed(file_changes.items()):
+        if version <= since:
+            break
+        if filename in user_files:
+            changed.append(user_files[filename])
+        else:
+            removed.append(filename)
+    changed.reverse()
+    removed.reverse()
+    return changed, removed
+
+
 def get_audio_object(filepath):
     """Returns the appropriate Mutagen audio object based on the extension."""
     ext = os.path.splitext(filepath)[1].lower()
@@ -67,60 +202,150 @@ def get_audio_object(filepath):
     return None
 
 
-def extract_metadata(filepath):
-    """Extracts basic metadata and prepares it for the interface."""
-    filename = os.path.basename(filepath)
-    ext = os.path.splitext(filepath)[1].lower().lstrip('.')
-
-    try:
-        audio = get_audio_object(filepath)
-        if audio is None:
+# ID3 frames and Vorbis comment fields holding the metadata shown in the interface
+ID3_FRAMES = {'title': 'TIT2', 'artist': 'TPE1', 'album': 'TALB', 'track': 'TRCK'}
+VORBIS_FIELDS = {'title': 'title', 'artist': 'artist', 'album': 'album', 'track': 'tracknumber'}
+
+
+def parse_vorbis_comment(data):
+    """Parses a Vorbis comment block (as found in FLAC and Ogg Vorbis) into {field: [values]}."""
+    vendor_length = int.from_bytes(data[0:4], 'little')
+    offset = 4 + vendor_length
+    count = int.from_bytes(data[offset:offset + 4], 'little')
+    offset += 4
+
+    comments = {}
+    for _ in range(count):
+        length = int.from_bytes(data[offset:offset + 4], 'little')
+        entry = data[offset + 4:offset + 4 + length].decode('utf-8', errors='replace')
+        offset += 4 + length
+        key, sep, value = entry.partition('=')
+        if sep:
+            comments.setdefault(key.lower(), []).append(value)
+    return comments
+
+
+def read_flac_comment_block(f):
+    """Reads the VORBIS_COMMENT metadata block of a FLAC file, skipping the other blocks."""
+    if f.read(4) != b'fLaC':
+        raise ValueError("Not a FLAC file")
+    while True:
+        block_header = f.read(4)
+        if len(block_header) < 4:
+            return None
+        length = int.from_bytes(block_header[1:4], 'big')
+        if block_header[0] & 0x7f == 4:
+            return f.read(length)
+        if block_header[0] & 0x80:
+            return None
+        f.seek(length, os.SEEK_CUR)
+
+
+def read_ogg_comment_packet(f):
+    """Reads the second packet of an Ogg Vorbis stream (the comment header), without its 7-byte prefix."""
+    packets = []
+    while True:
+        page = OggPage(f)
+        for i, packet in enumerate(page.packets):
+            if i == 0 and page.continued and packets:
+                packets[-1] += packet
+            else:
+                packets.append(packet)
+        # The comment packet is complete once a third packet starts or the page closes it
+        if len(packets) > 2 or (len(packets) == 2 and page.complete):
+            break
+    if not packets[1].startswith(b'\x03vorbis'):
+        raise ValueError("Not an Ogg Vorbis comment header")
+    return packets[1][7:]
+
+
+def read_tags_lean(filepath, ext):
+    """Reads title/artist/album/track reading only the tag blocks of the file (no audio parsing)."""
+    if ext == 'mp3':
+        tags = ID3(filepath)
+        return {key: tags[frame].text for key, frame in ID3_FRAMES.items() if frame in tags}
+
+    with open(filepath, 'rb') as f:
+        if ext == 'flac':
+            data = read_flac_comment_block(f)
+        elif ext == 'ogg':
+            data = read_ogg_comment_packet(f)
+        else:
             raise ValueError(f"Unsupported extension: {ext}")
 
-        tags = audio.tags
-        if tags is None and ext == 'mp3':
+    if data is None:
+        raise ID3NoHeaderError("No Mutagen tags found.")
+    comments = parse_vorbis_comment(data)
+    return {key: comments.get(field) for key, field in VORBIS_FIELDS.items()}
+
+
+def read_tags_full(filepath, ext):
+    """Reads title/artist/album/track through the complete Mutagen audio objects."""
+    audio = get_audio_object(filepath)
+    if audio is None:
+        raise ValueError(f"Unsupported extension: {ext}")
+
+    tags = audio.tags
+    if tags is None and ext == 'mp3':
+        try:
+            # Try a re-read for ID3 tags
+            audio = MP3(filepath)
+            tags = audio.tags
+        except:
+            pass
+
+    if tags is None:
+        raise ID3NoHeaderError("No Mutagen tags found.")
+
+    if ext == 'mp3':
+        return {key: tags.get(frame) for key, frame in ID3_FRAMES.items()}
+    # Vorbis comments use lowercase
+    return {key: tags.get(field) for key, field in VORBIS_FIELDS.items()}
+
+
+def get_tag_value(tags, tag_key, default='Sconosciuto'):
+    """Normalizes a raw tag value (string or list) for the interface."""
+    val = tags.get(tag_key)
+    if val:
+        if isinstance(val, list):
+            v = str(val[0]).strip()
+        else:
+            v = str(val).strip()
+
+        if tag_key == 'track':
             try:
-                # Try a re-read for ID3 tags
-                audio = MP3(filepath)
-                tags = audio.tags
+                # Handles '1/10' formats
+                return int(v.split('/')[0])
             except:
-                pass
+                return 0
 
-        if tags is None:
-            raise ID3NoHeaderError("No Mutagen tags found.")
+        return v if v else default
+    return default
 
-        def get_tag_value(tag_key, default='Sconosciuto'):
-            if ext == 'mp3':
-                val = tags.get(tag_key.upper())
-            else:
-                # Vorbis comments use lowercase
-                val = tags.get(tag_key.lower())
 
-            if val:
-                if isinstance(val, list):
-                    v = str(val[0]).strip()
-                else:
-                    v = str(val).strip()
+def extract_metadata(filepath, mode=None, log_errors=True):
+    """Extracts basic metadata and prepares it for the interface.
 
-                if tag_key.lower() == 'track':
-                    try:
-                        # Handles '1/10' formats
-                        return int(v.split('/')[0])
-                    except:
-                        return 0
+    mode is 'lean' or 'full' (default: TAG_EXTRACTION_MODE).
+    """
+    filename = os.path.basename(filepath)
+    ext = os.path.splitext(filepath)[1].lower().lstrip('.')
 
-                return v if v else default
-            return default
+    try:
+        if (mode or TAG_EXTRACTION_MODE) == 'lean':
+            tags = read_tags_lean(filepath, ext)
+        else:
+            tags = read_tags_full(filepath, ext)
 
         metadata = {
             'filepath': filepath,
             'filename': filename,
             'ext': ext,
             'status': 'Metadati estratti, pronto per MusicBrainz',
-            'title': get_tag_value('title'),
-            'artist': get_tag_value('artist'),
-            'album': get_tag_value('album'),
-            'track': get_tag_value('track')
+            'title': get_tag_value(tags, 'title'),
+            'artist': get_tag_value(tags, 'artist'),
+            'album': get_tag_value(tags, 'album'),
+            'track': get_tag_value(tags, 'track')
         }
 
         if metadata['artist'] == 'Sconosciuto' and metadata['title'] == 'Sconosciuto':
@@ -129,7 +354,8 @@ def extract_metadata(filepath):
         return metadata
 
     except (ID3NoHeaderError, Exception) as e:
-        logger.error(f"Error extracting metadata for {filename}: {e}")
+        if log_errors:
+            logger.error(f"Error extracting metadata for {filename}: {e}")
         return {
             'filepath': filepath,
             'filename': filename,
@@ -142,14 +368,79 @@ def extract_metadata(filepath):
         }
 
 
+def extract_metadata_batch(filepaths, mode=None):
+    """Extracts the metadata of many files, across the process pool for large batches.
+
+    Extraction errors are logged once per batch, grouped by type.
+    """
+    global extract_pool
+    results = None
+    if len(filepaths) >= EXTRACT_POOL_MIN_BATCH and EXTRACT_WORKERS > 1:
+        if extract_pool is None:
+            extract_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS)
+        chunksize = max(1, len(filepaths) // (EXTRACT_WORKERS * 4))
+        try:
+            results = list(extract_pool.map(extract_metadata, filepaths, [mode] * len(filepaths),
+                                            [False] * len(filepaths), chunksize=chunksize))
+        except BrokenProcessPool as e:
+            # A worker died (e.g. killed for memory): a new pool is created for the next batch
+            logger.error(f"Extraction process pool broken, extracting {len(filepaths)} files in-thread: {e}")
+            extract_pool = None
+
+    if results is None:
+        results = [extract_metadata(filepath, mode, log_errors=False) for filepath in filepaths]
+
+    errors = Counter(m['status'] for m in results if m['status'].startswith('Errore'))
+    if errors:
+        summary = ', '.join(f"{count} x {status}" for status, count in errors.items())
+        logger.error(f"Metadata extraction failed for {sum(errors.values())}/{len(results)} files: {summary}")
+    return results
+
+
+def normalize_lookup_key(artist, title):
+    """Builds the cache key: case, accents, punctuation, symbols and whitespace are ignored."""
+    def normalize(value):
+        value = unicodedata.normalize('NFKD', str(value)).casefold()
+        # Unicode punctuation (P*) and symbols (S*) count as separators, e.g. "Don’t" == "Don't"
+        value = ''.join(' ' if unicodedata.category(c)[0] in 'PS' else c
+                        for c in value if not unicodedata.combining(c))
+        return ' '.join(value.split())
+
+    return f"{normalize(artist)}\x1f{normalize(title)}"
+
+
+def lookup_recording(artist, title):
+    """Returns the best MusicBrainz recording for artist/title (None if not found), using the cache.
+
+    API errors are raised and never cached.
+    """
+    key = normalize_lookup_key(artist, title)
+    with mb_cache_lock:
+        row = mb_cache.execute("SELECT recording, expires_at FROM recordings WHERE key = ?", (key,)).fetchone()
+    if row and row[1] > time.time():
+        logger.info(f"MusicBrainz cache hit for {artist} - {title}")
+        return json.loads(row[0]) if row[0] is not None else None
+
+    query = f"artist:\"{artist}\" AND track:\"{title}\""
+    result = musicbrainzngs.search_recordings(query=query, limit=10)
+    recording = result['recording-list'][0] if result['recording-list'] else None
+
+    ttl = MUSICBRAINZ_CACHE_TTL if recording is not None else MUSICBRAINZ_CACHE_NEGATIVE_TTL
+    with mb_cache_lock:
+        mb_cache.execute(
+            "INSERT OR REPLACE INTO recordings (key, recording, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(recording) if recording is not None else None, time.time() + ttl))
+        mb_cache.execute("DELETE FROM recordings WHERE expires_at <= ?", (time.time(),))
+        mb_cache.commit()
+    return recording
+
+
 def search_musicbrainz(metadata):
     """Searches for the track on MusicBrainz using existing metadata."""
     try:
-        query = f"artist:\"{metadata['artist']}\" AND track:\"{metadata['title']}\""
-        result = musicbrainzngs.search_recordings(query=query, limit=10)
+        recording = lookup_recording(metadata['artist'], metadata['title'])
 
-        if result['recording-list']:
-            recording = result['recording-list'][0]
+        if recording:
             new_metadata = {
                 'title': recording.get('title', metadata['title']),
                 'artist': recording.get('artist-credit-phrase', metadata['artist']),
@@ -186,8 +477,231 @@ def search_musicbrainz(metadata):
         return metadata
 
 
-def rename_and_move_file(metadata, pattern):
-    """Renames and moves the file to OUTPUT_DIR using the given pattern."""
+# --- FILE MOVES AND DUPLICATES ---
+
+def audio_payload_ranges(f, ext, size):
+    """Returns the (start, end) byte range of the audio payload, skipping the tag blocks.
+
+    For Ogg files the header pages (including the Vorbis comments) are skipped, but the
+    audio pages still carry their page headers, which are excluded by hash_audio_payload.
+    """
+    start, end = 0, size
+    if ext == 'mp3':
+        header = f.read(10)
+        if header[:3] == b'ID3':
+            # ID3v2: syncsafe size, plus 10 bytes of header (and 10 of footer if flagged)
+            tag_size = 0
+            for b in header[6:10]:
+                tag_size = (tag_size << 7) | (b & 0x7f)
+            start = 10 + tag_size + (10 if header[5] & 0x10 else 0)
+        if size >= 128:
+            f.seek(size - 128)
+            if f.read(3) == b'TAG':
+                end = size - 128
+    elif ext == 'flac':
+        if f.read(4) == b'fLaC':
+            # Metadata blocks: 1 byte (last flag + type) and 3 bytes of length each
+            start = 4
+            while True:
+                f.seek(start)
+                block_header = f.read(4)
+                if len(block_header) < 4:
+                    break
+                start += 4 + int.from_bytes(block_header[1:4], 'big')
+                if block_header[0] & 0x80:
+                    break
+    elif ext == 'ogg':
+        # The three Vorbis header packets end on a page boundary: skip their pages
+        packets = 0
+        while packets < 3:
+            f.seek(start)
+            page_header = f.read(27)
+            if len(page_header) < 27 or page_header[:4] != b'OggS':
+                break
+            lacing = f.read(page_header[26])
+            packets += sum(1 for value in lacing if value < 255)
+            start += 27 + len(lacing) + sum(lacing)
+    return start, max(start, end)
+
+
+def hash_audio_payload(filepath):
+    """Streaming hash of the audio payload of a file (tags excluded)."""
+    ext = os.path.splitext(filepath)[1].lower().lstrip('.')
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filepath, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        start, end = audio_payload_ranges(f, ext, size)
+        f.seek(start)
+
+        if ext == 'ogg':
+            # Hash only the page bodies: sequence numbers and checksums change with the tags
+            while True:
+                page_header = f.read(27)
+                if len(page_header) < 27 or page_header[:4] != b'OggS':
+                    break
+                lacing = f.read(page_header[26])
+                digest.update(f.read(sum(lacing)))
+        else:
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(COPY_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+
+    return digest.hexdigest()
+
+
+def index_library_file(path, audio_hash=None):
+    """Adds (or refreshes) a file of the output library in the audio hash index."""
+    st = os.stat(path)
+    if audio_hash is None:
+        audio_hash = hash_audio_payload(path)
+    with library_db_lock:
+        library_db.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime, audio_hash) VALUES (?, ?, ?, ?)",
+            (path, st.st_size, st.st_mtime, audio_hash))
+        library_db.commit()
+    return audio_hash
+
+
+def find_duplicate(audio_hash):
+    """Returns the path of a library file with the same audio payload, or None."""
+    with library_db_lock:
+        paths = [row[0] for row in library_db.execute("SELECT path FROM files WHERE audio_hash = ?", (audio_hash,))]
+    for path in paths:
+        if os.path.exists(path):
+            return path
+        # Stale entry: the file was removed from the library
+        with library_db_lock:
+            library_db.execute("DELETE FROM files WHERE path = ?", (path,))
+            library_db.commit()
+    return None
+
+
+def start_library_index():
+    """Starts updating the library index in the background (only the first time it is called)."""
+    global library_index_thread
+    with library_index_lock:
+        if library_index_thread is None:
+            library_index_thread = Thread(target=index_output_library, daemon=True)
+            library_index_thread.start()
+
+
+def index_output_library():
+    """Brings the audio hash index up to date with the files in OUTPUT_DIR, then sets library_index_ready."""
+    try:
+        update_library_index()
+    finally:
+        # Even after an error moves must not wait forever: the index is as complete as it could be
+        library_index_ready.set()
+
+
+def update_library_index():
+    """Hashes the new or changed files of OUTPUT_DIR and forgets the removed ones."""
+    with library_db_lock:
+        known = {row[0]: (row[1], row[2]) for row in library_db.execute("SELECT path, size, mtime FROM files")}
+
+    indexed = 0
+    for root, _, files in os.walk(OUTPUT_DIR):
+        for name in files:
+            if not name.lower().endswith(MUSIC_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+                if known.pop(path, None) != (st.st_size, st.st_mtime):
+                    index_library_file(path)
+                    indexed += 1
+            except OSError as e:
+                logger.error(f"Error indexing {path}: {e}")
+
+    # Whatever is left in known no longer exists
+    with library_db_lock:
+        library_db.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in known])
+        library_db.commit()
+    logger.info(f"Library index updated: {indexed} files hashed, {len(known)} removed")
+
+
+def copy_file_kernel(src, dst, progress=None):
+    """Copies src to dst letting the kernel move the data (copy_file_range/sendfile)."""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        copied = 0
+        copy = getattr(os, 'copy_file_range', None)
+        while copied < size:
+            try:
+                if copy is not None:
+                    sent = copy(fsrc.fileno(), fdst.fileno(), COPY_CHUNK_SIZE)
+                else:
+                    sent = os.sendfile(fdst.fileno(), fsrc.fileno(), copied, COPY_CHUNK_SIZE)
+            except OSError as e:
+                if copy is not None and e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    # copy_file_range not supported across these filesystems: fall back to sendfile
+                    copy = None
+                    continue
+                raise
+            if sent == 0:
+                break
+            copied += sent
+            if progress:
+                progress(copied, size)
+        os.fsync(fdst.fileno())
+    shutil.copystat(src, dst)
+
+
+def link_no_overwrite(src, dst):
+    """Renames src to dst, failing with FileExistsError if dst exists (even if created meanwhile).
+
+    os.replace would silently overwrite: a hard link is created atomically only if dst is missing.
+    On filesystems without hard links (vfat/exFAT, many CIFS/FUSE mounts) the check and the
+    rename are serialized by a lock instead, which protects against the moves of this process.
+    """
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        raise FileExistsError(f"Il file di destinazione esiste già: {dst}")
+    except OSError as e:
+        if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EMLINK, errno.ENOSYS):
+            raise
+        with move_fallback_lock:
+            if os.path.exists(dst):
+                raise FileExistsError(f"Il file di destinazione esiste già: {dst}")
+            os.replace(src, dst)
+        return
+    os.unlink(src)
+
+
+def move_file(src, dst, progress=None):
+    """Moves src to dst without overwriting it.
+
+    On the same device it is a plain link + unlink; across devices the file is copied to a
+    temporary file next to dst, which is then linked in place, so dst never appears half-written.
+    """
+    try:
+        link_no_overwrite(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    tmp_path = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.{uuid.uuid4().hex}.part")
+    try:
+        copy_file_kernel(src, tmp_path, progress)
+        link_no_overwrite(tmp_path, dst)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    os.remove(src)
+
+
+def rename_and_move_file(metadata, pattern, progress=None):
+    """Renames and moves the file to OUTPUT_DIR using the given pattern.
+
+    progress(copied, total) is called while copying across devices. With DUPLICATE_DETECTION
+    a file whose audio is already in the library is not moved.
+    """
 
     # Make metadata safe for directory names (replace invalid characters)
     # Rendi i metadati sicuri per i nomi di file/directory
@@ -201,10 +715,20 @@ def rename_and_move_file(metadata, pattern):
         new_abs_path = os.path.join(OUTPUT_DIR, new_relative_path)
         target_dir = os.path.dirname(new_abs_path)
 
+        audio_hash = None
+        if DUPLICATE_DETECTION:
+            audio_hash = hash_audio_payload(metadata['filepath'])
+            duplicate = find_duplicate(audio_hash)
+            if duplicate:
+                raise FileExistsError(f"Traccia già presente nella libreria: {duplicate}")
+
         # Create the destination folder if it doesn't exist
         os.makedirs(target_dir, exist_ok=True)
         # Move the file
-        shutil.move(metadata['filepath'], new_abs_path)
+        move_file(metadata['filepath'], new_abs_path, progress)
+
+        if DUPLICATE_DETECTION:
+            index_library_file(new_abs_path, audio_hash)
 
         return new_abs_path
 
@@ -216,6 +740,153 @@ def rename_and_move_file(metadata, pattern):
         raise Exception(f"Error during move/rename operation: {e}")
 
 
+def process_file(filename, pattern):
+    """Complete operation for a single file: MusicBrainz search + Rename/Move.
+
+    Returns the new path; raises on failure after recording the error in the file status.
+    """
+    return move_looked_up_file(filename, look_up_file(filename), pattern)
+
+
+def look_up_file(filename):
+    """First step of the processing: MusicBrainz search, stored in the file state.
+
+    Returns the enriched metadata.
+    """
+    with file_lock:
+        metadata = user_files.get(filename)
+    if not metadata:
+        raise ValueError(f"File {filename} non trovato o già processato.")
+
+    # Start MusicBrainz search (may take time) on a copy: the stored entry may be serialized meanwhile
+    logger.info(f"Starting MusicBrainz search for {filename}")
+    enriched_metadata = search_musicbrainz({**metadata})
+
+    with file_lock:
+        # Update the state with enriched metadata
+        set_file(filename, enriched_metadata)
+    return enriched_metadata
+
+
+def move_looked_up_file(filename, enriched_metadata, pattern):
+    """Second step of the processing: Rename/Move, then removal from the state.
+
+    Returns the new path; raises on failure after recording the error in the file status.
+    """
+    def report_progress(copied, total):
+        with file_lock:
+            if filename in user_files:
+                set_file(filename, {**user_files[filename], 'status': f"Copia in corso: {copied * 100 // total}%"})
+
+    if DUPLICATE_DETECTION and not library_index_ready.is_set():
+        with file_lock:
+            if filename in user_files:
+                set_file(filename, {**user_files[filename], 'status': "In attesa dell'indice della libreria"})
+        start_library_index()
+        library_index_ready.wait()
+
+    try:
+        # Rename and move the file
+        new_path = rename_and_move_file(enriched_metadata, pattern, report_progress)
+
+        # Remove the file from state upon success
+        with file_lock:
+            remove_file(filename)
+
+        logger.info(f"File processed and moved successfully to: {new_path}")
+        return new_path
+
+    except Exception as e:
+        logger.error(f"Critical error during processing of {filename}: {e}")
+        # Update status for the error
+        with file_lock:
+            if filename in user_files:
+                set_file(filename, {**user_files[filename], 'status': f"ERRORE CRITICO: {str(e)}"})
+        raise
+
+
+# --- BATCH JOBS ---
+
+def create_rename_job(filenames, pattern):
+    """Registers a batch rename job and schedules its files on the job executor."""
+    job_id = uuid.uuid4().hex
+    with jobs_lock:
+        jobs[job_id] = {
+            'job_id': job_id,
+            'pattern': pattern,
+            'status': 'in coda' if filenames else 'completato',
+            'total': len(filenames),
+            'done': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'created_at': time.time(),
+            'finished_at': None if filenames else time.time(),
+            'results': {f: {'status': 'in coda'} for f in filenames},
+        }
+        if not filenames:
+            prune_finished_jobs()
+
+    # One task per file: the executor queue interleaves concurrent jobs fairly
+    for filename in filenames:
+        lookup_executor.submit(run_job_lookup, job_id, filename, pattern)
+
+    logger.info(f"Batch job {job_id} created for {len(filenames)} files")
+    return job_id
+
+
+def run_job_lookup(job_id, filename, pattern):
+    """Lookup stage of a batch job item: hands the file over to the move stage."""
+    set_job_item(job_id, filename, {'status': 'ricerca MusicBrainz'})
+    try:
+        enriched_metadata = look_up_file(filename)
+    except Exception as e:
+        finish_job_item(job_id, filename, {'status': 'errore', 'message': str(e)})
+        return
+
+    set_job_item(job_id, filename, {'status': 'in attesa di spostamento'})
+    move_executor.submit(run_job_move, job_id, filename, enriched_metadata, pattern)
+
+
+def run_job_move(job_id, filename, enriched_metadata, pattern):
+    """Move stage of a batch job item."""
+    set_job_item(job_id, filename, {'status': 'spostamento'})
+    try:
+        new_path = move_looked_up_file(filename, enriched_metadata, pattern)
+        result = {'status': 'successo', 'new_path': new_path}
+    except Exception as e:
+        result = {'status': 'errore', 'message': str(e)}
+    finish_job_item(job_id, filename, result)
+
+
+def set_job_item(job_id, filename, result):
+    """Updates the progress of a job item that is still running."""
+    with jobs_lock:
+        jobs[job_id]['status'] = 'in corso'
+        jobs[job_id]['results'][filename] = result
+
+
+def finish_job_item(job_id, filename, result):
+    """Records the final result of a job item and completes the job after its last item."""
+    with jobs_lock:
+        job = jobs[job_id]
+        job['results'][filename] = result
+        job['done'] += 1
+        job['succeeded' if result['status'] == 'successo' else 'failed'] += 1
+        if job['done'] == job['total']:
+            job['status'] = 'completato'
+            job['finished_at'] = time.time()
+            logger.info(f"Batch job {job_id} completed: {job['succeeded']} ok, {job['failed']} errors")
+            prune_finished_jobs()
+
+
+def prune_finished_jobs():
+    """Drops the oldest completed jobs beyond MAX_FINISHED_JOBS. Must be called with jobs_lock held."""
+    finished = [job_id for job_id, job in jobs.items() if job['status'] == 'completato']
+    # jobs keeps creation order: the first ones are the oldest
+    for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+        del jobs[job_id]
+
+
 # --- WATCHDOG MONITORING ---
 
 class MediaFileHandler(FileSystemEventHandler):
@@ -224,21 +895,66 @@ class MediaFileHandler(FileSystemEventHandler):
     def on_created(self, event):
         """Handles the creation of a new file."""
         if not event.is_directory and event.src_path.lower().endswith(MUSIC_EXTENSIONS):
-            Thread(target=self.process_new_file, args=(event.src_path,)).start()
+            ingest_queue.put((event.src_path, time.time()))
 
-    def process_new_file(self, filepath):
-        """Logic for metadata extraction and adding to state."""
-        filename = os.path.basename(filepath)
-        # Wait a moment to ensure file writing is complete
-        time.sleep(1)
+    def on_modified(self, event):
+        """A file still being written: postpones its extraction (ignored if not waiting)."""
+        if not event.is_directory and event.src_path.lower().endswith(MUSIC_EXTENSIONS):
+            ingest_queue.put((event.src_path, None))
 
-        logger.info(f"New file detected: {filename}")
-        metadata = extract_metadata(filepath)
 
+def process_new_files(filepaths):
+    """Extracts the metadata of a batch of files and adds them to state."""
+    start = time.time()
+    for metadata in extract_metadata_batch(filepaths):
         with file_lock:
-            user_files[filename] = metadata
+            set_file(metadata['filename'], metadata)
+    logger.info(f"Metadata extracted for {len(filepaths)} files in {time.time() - start:.2f}s")
+
+
+def ingest_new_files():
+    """Collects the files detected by Watchdog and processes them in batches.
+
+    Each file waits until it has had no events for FILE_SETTLE_TIME seconds and its
+    size/mtime did not change between two checks, so half-written files are not extracted.
+    """
+    waiting = {}  # path -> [time of the last event, (size, mtime) at the last check]
+    while True:
+        try:
+            event = ingest_queue.get(timeout=FILE_SETTLE_TIME / 2) if waiting else ingest_queue.get()
+            while True:
+                path, created_at = event
+                if created_at is not None:
+                    waiting[path] = [created_at, None]
+                elif path in waiting:
+                    waiting[path][0] = time.time()
+                event = ingest_queue.get_nowait()
+        except Empty:
+            pass
+
+        ready = []
+        now = time.time()
+        for path, state in list(waiting.items()):
+            if now - state[0] < FILE_SETTLE_TIME:
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                # Removed or moved away before being extracted
+                del waiting[path]
+                continue
+            if state[1] == (st.st_size, st.st_mtime):
+                ready.append(path)
+                del waiting[path]
+            else:
+                state[1] = (st.st_size, st.st_mtime)
 
-        logger.info(f"Metadata extracted for {filename}: {metadata}")
+        if ready:
+            try:
+                process_new_files(ready)
+            except Exception as e:
+                # Never stop the only ingest thread: the next files must still be processed
+                logger.error(f"Error ingesting {len(ready)} new files: {e}")
 
 
 def start_file_monitoring():
@@ -248,12 +964,16 @@ def start_file_monitoring():
     print(os.getcwd())
     print(os.listdir())
     # Initial scan of existing files
+    existing_files = []
     for filename in os.listdir(INPUT_DIR):
         filepath = os.path.join(INPUT_DIR, filename)
         if os.path.isfile(filepath) and filename.lower().endswith(MUSIC_EXTENSIONS):
-            MediaFileHandler().process_new_file(filepath)
+            existing_files.append(filepath)
+    if existing_files:
+        process_new_files(existing_files)
 
     # Start the Watchdog Observer
+    Thread(target=ingest_new_files, daemon=True).start()
     event_handler = MediaFileHandler()
     observer = Observer()
     observer.schedule(event_handler, INPUT_DIR, recursive=False)
@@ -281,18 +1001,91 @@ def serve_frontend():
 
 @app.route('/api/status', methods=['GET'])
 def get_status():
-    """Returns the application and file status."""
+    """Returns the application and file status.
+
+    Without parameters the full file list is returned. With since=<version> only the files
+    changed after that version are returned, plus the names of the removed ones ('reset' is
+    true when the version is too old, or comes from before a restart, and the list is complete
+    instead). limit=<n> turns on pagination of the full list (at most STATUS_PAGE_SIZE files
+    per page) and offset=<n> selects the page; offset alone uses pages of STATUS_PAGE_SIZE.
+    """
+    since = request.args.get('since', type=int)
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(0, limit)
+    elif 'offset' in request.args:
+        limit = STATUS_PAGE_SIZE
+
     with file_lock:
-        file_list = list(user_files.values())
+        version = status_version
+        total_files = len(user_files)
+        reset = since is None or since < tombstone_floor or since > status_version
+        if reset:
+            if limit is None:
+                file_list = list(user_files.values())
+            else:
+                # dicts keep insertion order: the pages are stable between changes
+                file_list = list(islice(user_files.values(), offset, offset + min(limit, STATUS_PAGE_SIZE)))
+            removed = []
+        else:
+            file_list, removed = get_status_delta(since)
 
-    return jsonify({
+    status = {
         'processor_status': 'Monitoraggio Watchdog Attivo',
         'input_dir': INPUT_DIR,
         'output_dir': OUTPUT_DIR,
         'naming_pattern': current_naming_pattern,
-        'total_files': len(file_list),
+        'version': version,
+        'total_files': total_files,
         'files': file_list
-    })
+    }
+    if DUPLICATE_DETECTION:
+        status['library_index'] = 'pronto' if library_index_ready.is_set() else 'in costruzione'
+    if since is not None:
+        status['reset'] = reset
+        status['removed'] = removed
+    if limit is not None:
+        status['offset'] = offset
+    return jsonify(status)
+
+
+@app.route('/api/status/stream', methods=['GET'])
+def stream_status():
+    """Server-Sent Events stream of the file changes, starting after since=<version> (default: now)."""
+    since = request.args.get('since', type=int)
+    if since is None:
+        # Browsers send the id of the last received event when they reconnect
+        since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        with file_lock:
+            since = status_version
+
+    def generate():
+        nonlocal since
+        while True:
+            with file_lock:
+                # Wake up periodically to send a keep-alive comment
+                file_changed.wait_for(lambda: status_version != since, timeout=15)
+                if status_version == since:
+                    changes = None
+                elif since < tombstone_floor or since > status_version:
+                    # Too old, or from before a restart (the version starts again from 0)
+                    changes = {'reset': True, 'files': list(user_files.values()), 'removed': []}
+                else:
+                    files, removed = get_status_delta(since)
+                    changes = {'reset': False, 'files': files, 'removed': removed}
+                since = status_version
+                total_files = len(user_files)
+
+            if changes is None:
+                yield ": keep-alive\n\n"
+            else:
+                changes['version'] = since
+                changes['total_files'] = total_files
+                yield f"id: {since}\ndata: {json.dumps(changes)}\n\n"
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 
 @app.route('/api/rename', methods=['POST'])
@@ -306,46 +1099,78 @@ def process_file_api():
         return jsonify({"success": False, "message": "Nome file o pattern mancante."}), 400
 
     with file_lock:
-        metadata = user_files.get(filename_to_process)
-        if not metadata:
+        if filename_to_process not in user_files:
             return jsonify(
                 {"success": False, "message": f"File {filename_to_process} non trovato o già processato."}), 404
 
         global current_naming_pattern
         current_naming_pattern = new_pattern
 
-    # Start MusicBrainz search (may take time)
-    logger.info(f"Starting MusicBrainz search for {filename_to_process}")
-    enriched_metadata = search_musicbrainz(metadata)
+    try:
+        new_path = process_file(filename_to_process, new_pattern)
+        return jsonify({"success": True, "message": f"Successo! Spostato in {new_path}"})
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@app.route('/api/jobs/rename', methods=['POST'])
+def create_rename_job_api():
+    """API to start a batch job: MusicBrainz + Rename/Move for many files in the background.
+
+    The body contains the 'pattern' and either a list of 'filenames' or a 'filter'
+    (shell-style wildcard on the filename, e.g. "*.flac"; "*" selects every file).
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "message": "Il corpo della richiesta deve essere un oggetto JSON."}), 400
+    new_pattern = data.get('pattern')
+    filenames = data.get('filenames')
+    name_filter = data.get('filter')
+
+    if not new_pattern or (filenames is None and name_filter is None):
+        return jsonify({"success": False, "message": "Pattern o lista file/filtro mancante."}), 400
+    if filenames is not None and (not isinstance(filenames, list) or
+                                  not all(isinstance(f, str) for f in filenames)):
+        return jsonify({"success": False, "message": "'filenames' deve essere una lista di nomi di file."}), 400
+    if filenames is None and not isinstance(name_filter, str):
+        return jsonify({"success": False, "message": "'filter' deve essere una stringa."}), 400
 
     with file_lock:
-        # Update the state with enriched metadata
-        user_files[filename_to_process] = enriched_metadata
+        if filenames is None:
+            filenames = sorted(f for f in user_files if fnmatch.fnmatch(f, name_filter))
+        else:
+            # Each file is processed once, even if listed more than once
+            filenames = list(dict.fromkeys(filenames))
+        missing = [f for f in filenames if f not in user_files]
 
-    try:
-        # Rename and move the file
-        new_path = rename_and_move_file(enriched_metadata, new_pattern)
+        global current_naming_pattern
+        current_naming_pattern = new_pattern
 
-        # Remove the file from state upon success
-        with file_lock:
-            del user_files[filename_to_process]
+    if missing:
+        return jsonify({"success": False, "message": f"File non trovati o già processati: {', '.join(missing)}"}), 404
 
-        logger.info(f"File processed and moved successfully to: {new_path}")
-        return jsonify({"success": True, "message": f"Successo! Spostato in {new_path}"})
+    job_id = create_rename_job(filenames, new_pattern)
+    return jsonify({"success": True, "job_id": job_id, "total": len(filenames)}), 202
 
-    except Exception as e:
-        logger.error(f"Critical error during processing of {filename_to_process}: {e}")
-        # Update status for the error
-        with file_lock:
-            if filename_to_process in user_files:
-                user_files[filename_to_process]['status'] = f"ERRORE CRITICO: {str(e)}"
 
-        return jsonify({"success": False, "message": str(e)}), 500
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_api(job_id):
+    """Returns progress and per-file results of a batch job."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({"success": False, "message": f"Job {job_id} non trovato."}), 404
+        job = {**job, 'results': dict(job['results'])}
+
+    return jsonify(job)
 
 
 # --- APPLICATION STARTUP ---
 
 if __name__ == '__main__':
+    if DUPLICATE_DETECTION:
+        start_library_index()
+
     # Start filesystem monitoring in a separate thread
     monitor_thread = Thread(target=start_file_monitoring, daemon=True)
     monitor_thread.start()
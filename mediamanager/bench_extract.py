@@ -0,0 +1,115 @@
+"""Micro-benchmark of the tag extraction modes on a generated corpus of MP3/FLAC/OGG files.
+
+Usage: python bench_extract.py [files per format]
+"""
+import os
+import sys
+import time
+import shutil
+import struct
+import tempfile
+
+from mutagen.id3 import ID3, TIT2, TPE1, TALB, TRCK
+from mutagen.flac import FLAC
+from mutagen.ogg import OggPage
+from mutagen.oggvorbis import OggVorbis
+
+FILES_PER_FORMAT = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+AUDIO_SIZE = 2 * 1024 * 1024
+
+# The app creates its directories on import: keep everything inside a temporary folder
+workdir = tempfile.mkdtemp(prefix='bench_extract_')
+os.environ['INPUT_DIR'] = os.path.join(workdir, 'input')
+os.environ['OUTPUT_DIR'] = os.path.join(workdir, 'output')
+os.environ['MUSICBRAINZ_CACHE_PATH'] = os.path.join(workdir, 'musicbrainz.db')
+os.environ['LIBRARY_INDEX_PATH'] = os.path.join(workdir, 'library.db')
+
+import app  # noqa: E402
+
+
+def write_mp3(path, i):
+    # MPEG-1 Layer III frames, 128 kbps, 44.1 kHz: 417 bytes each
+    frame = b'\xff\xfb\x90\x64' + bytes(413)
+    with open(path, 'wb') as f:
+        f.write(frame * (AUDIO_SIZE // len(frame)))
+    tags = ID3()
+    tags.add(TIT2(encoding=3, text=f"Title {i}"))
+    tags.add(TPE1(encoding=3, text=f"Artist {i % 50}"))
+    tags.add(TALB(encoding=3, text=f"Album {i % 100}"))
+    tags.add(TRCK(encoding=3, text=f"{i % 20 + 1}/20"))
+    tags.save(path)
+
+
+def write_flac(path, i):
+    # STREAMINFO only (last block), followed by fake frames: Mutagen adds the comments
+    streaminfo = struct.pack('>HH', 4096, 4096) + bytes(6)
+    streaminfo += ((44100 << 44) | (1 << 41) | (15 << 36) | (AUDIO_SIZE // 4)).to_bytes(8, 'big') + bytes(16)
+    with open(path, 'wb') as f:
+        f.write(b'fLaC' + bytes([0x80]) + len(streaminfo).to_bytes(3, 'big') + streaminfo)
+        f.write(b'\xff\xf8' + os.urandom(AUDIO_SIZE))
+    audio = FLAC(path)
+    audio.add_tags()
+    audio.tags.update({'title': f"Title {i}", 'artist': f"Artist {i % 50}",
+                       'album': f"Album {i % 100}", 'tracknumber': str(i % 20 + 1)})
+    audio.save()
+
+
+def write_ogg(path, i):
+    ident = b'\x01vorbis' + struct.pack('<IBIiiiBB', 0, 2, 44100, 0, 128000, 0, 0xb8, 1)
+    comment = b'\x03vorbis' + struct.pack('<I', 5) + b'bench' + struct.pack('<I', 0) + b'\x01'
+    setup = b'\x05vorbis' + bytes(100)
+    pages = []
+    for sequence, packets in enumerate([[ident], [comment, setup]]):
+        page = OggPage()
+        page.serial, page.sequence, page.packets = 1, sequence, packets
+        page.first = sequence == 0
+        pages.append(page)
+    chunk = 4000
+    for n in range(AUDIO_SIZE // chunk):
+        page = OggPage()
+        page.serial, page.sequence, page.packets = 1, n + 2, [os.urandom(chunk)]
+        page.position = (n + 1) * 1024
+        pages.append(page)
+    pages[-1].last = True
+    with open(path, 'wb') as f:
+        for page in pages:
+            f.write(page.write())
+    audio = OggVorbis(path)
+    audio.tags.update({'title': f"Title {i}", 'artist': f"Artist {i % 50}",
+                       'album': f"Album {i % 100}", 'tracknumber': str(i % 20 + 1)})
+    audio.save()
+
+
+def generate_corpus():
+    filepaths = []
+    for ext, writer in (('mp3', write_mp3), ('flac', write_flac), ('ogg', write_ogg)):
+        for i in range(FILES_PER_FORMAT):
+            path = os.path.join(app.INPUT_DIR, f"track_{i:05d}.{ext}")
+            writer(path, i)
+            filepaths.append(path)
+    return filepaths
+
+
+def run(name, extract, filepaths):
+    start = time.perf_counter()
+    results = extract(filepaths)
+    elapsed = time.perf_counter() - start
+    errors = sum(1 for m in results if m['status'].startswith('Errore'))
+    print(f"{name:<28} {elapsed:8.3f}s  {len(filepaths) / elapsed:9.0f} files/s  errors: {errors}")
+    return results
+
+
+if __name__ == '__main__':
+    try:
+        filepaths = generate_corpus()
+        print(f"Corpus: {len(filepaths)} files in {app.INPUT_DIR}")
+
+        full = run('full, sequential', lambda fps: [app.extract_metadata(fp, 'full') for fp in fps], filepaths)
+        lean = run('lean, sequential', lambda fps: [app.extract_metadata(fp, 'lean') for fp in fps], filepaths)
+        run('lean, batch (process pool)', lambda fps: app.extract_metadata_batch(fps, 'lean'), filepaths)
+
+        keys = ('title', 'artist', 'album', 'track')
+        mismatches = sum(1 for a, b in zip(full, lean) if any(a[k] != b[k] for k in keys))
+        print(f"Lean/full metadata mismatches: {mismatches}")
+    finally:
+        shutil.rmtree(workdir)
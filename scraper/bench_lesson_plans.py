@@ -0,0 +1,65 @@
+"""Benchmark dell'estrazione dei piani di studio su pagine HTML salvate.
+
+Confronta il metodo del notebook (albero completo con html.parser + find_all con una
+lambda) con il parsing ristretto ai soli curricula, con html.parser e con lxml.
+Senza argomenti usa una pagina sintetica con la stessa struttura di quella reale.
+
+Uso: python -m scraper.bench_lesson_plans [pagina.html ...]
+"""
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+from scraper.lesson_plans import ACTIVITY_CLASS, CURRICULUM_CLASS, parse_lesson_plan
+
+REPEAT = 20
+
+
+def synthetic_page(curricula=4, activities=40, news=300):
+    """Pagina finta: molto contenuto non interessante e qualche curriculum con la sua tabella."""
+    rows = ''.join(
+        f'<tr class="activity{" child" if i % 5 == 4 else ""}"><td><span class="{ACTIVITY_CLASS}">INSEGNAMENTO {i}</span>'
+        f'<strong class="text-nowrap">[INF/01 ITA]</strong></td><td>{i % 3 + 1}</td><td>{i % 2 + 1}</td><td>6</td></tr>'
+        for i in range(activities))
+    fieldsets = ''.join(
+        f'<fieldset class="collapsible {CURRICULUM_CLASS} panel panel-default" data-curriculum-id="c{n}">'
+        f'<legend class="panel-heading"><a class="panel-title">Curriculum {n}</a></legend>'
+        f'<div class="panel-body"><table class="table"><thead><tr><th>Insegnamento</th></tr></thead>'
+        f'<tbody>{rows}</tbody></table></div></fieldset>'
+        for n in range(curricula))
+    filler = ''.join(
+        f'<div class="news"><p>Avviso {i}: <strong>lezioni</strong> e <a href="/avvisi/{i}">dettagli</a></p></div>'
+        for i in range(news))
+    return f'<html><head><title>Piano di studi</title></head><body><nav>{filler}</nav>{fieldsets}{filler}</body></html>'
+
+
+def notebook_method(html):
+    """Il metodo di bs.ipynb: tutto l'albero, poi una lambda su ogni tag."""
+    soup = BeautifulSoup(html, 'html.parser')
+    curricula = soup.find_all(lambda tag: tag.has_attr('class') and CURRICULUM_CLASS in tag['class'])
+    return [[tag.text for tag in c.find_all(class_=ACTIVITY_CLASS)] for c in curricula]
+
+
+def run(name, parse, pages):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        for html in pages:
+            result = parse(html)
+    elapsed = (time.perf_counter() - start) / (REPEAT * len(pages))
+    print(f"{name:<32} {elapsed * 1000:8.2f} ms/pagina  ({len(result)} curricula nell'ultima)")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        pages = []
+        for path in sys.argv[1:]:
+            with open(path, 'rb') as f:
+                pages.append(f.read())
+    else:
+        pages = [synthetic_page().encode('utf8')]
+    print(f"{len(pages)} pagine, {sum(len(p) for p in pages) // 1024} KiB")
+
+    run('notebook (html.parser)', notebook_method, pages)
+    run('solo curricula, html.parser', lambda html: parse_lesson_plan(html, 'html.parser'), pages)
+    run('solo curricula, lxml', lambda html: parse_lesson_plan(html, 'lxml'), pages)
@@ -0,0 +1,104 @@
+"""Estrazione dei piani di studio (curricula e insegnamenti) dai corsi di laurea Sapienza.
+
+Le pagine vengono scaricate in parallelo rispettando il rate limit condiviso di
+http_ratelimited; di ogni pagina si costruiscono solo i sottoalberi 'curriculum'
+(SoupStrainer) e i risultati vengono scritti man mano in un file JSONL.
+
+Uso: python -m scraper.lesson_plans 33503 33504 -o lesson_plans.jsonl
+"""
+import argparse
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+
+from crawler.http_utils import http_ratelimited
+
+LESSON_PLAN_URL = 'https://corsidilaurea.uniroma1.it/it/course/{course_id}/attendance/lessons-plan'
+CURRICULUM_CLASS = 'curriculum'
+ACTIVITY_CLASS = 'activity-name'
+MAX_WORKERS = 4
+
+# lxml è molto più veloce di html.parser, ma è opzionale
+try:
+    import lxml  # noqa: F401
+    PARSER = 'lxml'
+except ImportError:
+    PARSER = 'html.parser'
+
+# Solo i tag con la classe 'curriculum' (e il loro contenuto) entrano nell'albero.
+# Durante il parsing l'attributo class è ancora la stringa intera ("collapsible curriculum panel ..."):
+# come per la lambda del notebook, serve cercare la classe tra quelle separate da spazi
+CURRICULUM_ONLY = SoupStrainer(class_=lambda value: value is not None and CURRICULUM_CLASS in value.split())
+
+
+def parse_lesson_plan(html, parser=PARSER):
+    """Estrae i curricula di una pagina: nome, id e insegnamenti (con i moduli segnati)."""
+    soup = BeautifulSoup(html, parser, parse_only=CURRICULUM_ONLY)
+
+    curricula = []
+    # I curricula annidati sono già dentro al sottoalbero del loro contenitore
+    for curriculum in soup.find_all(class_=CURRICULUM_CLASS):
+        if curriculum.find_parent(class_=CURRICULUM_CLASS):
+            continue
+        legend = curriculum.find('legend')
+        activities = []
+        for activity in curriculum.find_all(class_=ACTIVITY_CLASS):
+            row = activity.find_parent('tr')
+            activities.append({
+                'name': activity.get_text(strip=True),
+                'module': row is not None and 'child' in row.get('class', []),
+            })
+        curricula.append({
+            'name': legend.get_text(strip=True) if legend else None,
+            'curriculum_id': curriculum.get('data-curriculum-id'),
+            'activities': activities,
+        })
+    return curricula
+
+
+def scrape_course(session, course_id):
+    """Scarica e analizza il piano di studi di un corso; gli errori finiscono nel risultato."""
+    url = LESSON_PLAN_URL.format(course_id=course_id)
+    try:
+        response = http_ratelimited(session.get, url, timeout=30)
+        response.raise_for_status()
+        return {'course_id': course_id, 'url': url, 'curricula': parse_lesson_plan(response.content)}
+    except Exception as e:
+        # Qualsiasi errore (rete, parsing, rate limit) riguarda solo questo corso: il run continua
+        return {'course_id': course_id, 'url': url, 'error': f"{type(e).__name__}: {e}"}
+
+
+def scrape_courses(course_ids, max_workers=MAX_WORKERS):
+    """Genera i risultati dei corsi man mano che sono pronti (non nell'ordine di course_ids)."""
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(scrape_course, session, course_id) for course_id in course_ids]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def scrape_to_jsonl(course_ids, path, max_workers=MAX_WORKERS):
+    """Scrive un risultato per riga in path, appena disponibile; restituisce il numero di errori."""
+    errors = 0
+    with open(path, 'w', encoding='utf8') as f:
+        for result in scrape_courses(course_ids, max_workers):
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+            f.flush()
+            if 'error' in result:
+                errors += 1
+                print(f"ERRORE corso {result['course_id']}: {result['error']}", file=sys.stderr)
+            else:
+                print(f"corso {result['course_id']}: {len(result['curricula'])} curricula")
+    return errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('course_ids', nargs='+', help="id dei corsi, es. 33503")
+    parser.add_argument('-o', '--output', default='lesson_plans.jsonl')
+    parser.add_argument('-w', '--workers', type=int, default=MAX_WORKERS)
+    args = parser.parse_args()
+
+    sys.exit(1 if scrape_to_jsonl(args.course_ids, args.output, args.workers) else 0)